@@ -1,10 +1,17 @@
 import re
 import io
+import string
+import hashlib
 import zipfile
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from datetime import datetime
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
+import xlsxwriter
+from pyarrow import csv as pa_csv
+from rapidfuzz import fuzz, process
 
 # =========================================================
 # CONFIGURATION
@@ -32,12 +39,15 @@ TARGET_HEADERS = [
 # 2️⃣ Export headers (no PREVIEW)
 EXPORT_HEADERS = [h for h in TARGET_HEADERS if h != "PREVIEW"]
 
+# Headers always (re)computed by process_data, so never fuzzy-matched
+COMPUTED_HEADERS = ["CYCLE", "BUCKET", "WITH CONTACT Y/N", "PREVIEW"]
+
 # 3️⃣ Header aliases for flexible mapping
 HEADER_ALIASES = {
     "CYCLE": ["COLLECTION CYCLE", "CYCLES"],
     "LOAN NUMBER": ["LOAN NO", "LOAN#", "loan number", "ACCOUNT NUMBER", "ACCOUNT NO", "ACCT NO", "ACCT NUMBER"],
     "CUSTOMER NAME": ["CLIENT NAME", "BORROWER NAME", "CUSTOMER", "NAME"],
-    "MOBILE NUMBER": ["CONTACT NO", "CONTACT NUMBER", "CELLPHONE NO", "PHONE NUMBER", "MOBILE NO"],
+    "MOBILE NUMBER": ["CONTACT NO", "CONTACT NUMBER", "CELLPHONE NO", "PHONE NUMBER", "MOBILE NO", "MOBILE"],
     "BOS/CB": ["BOS", "CB", "BRANCH", "CENTER"],
     "OB": ["Amount Overdue", "OUTSTANDING BALANCE", "AMOUNT_OUTSTANDING", "OUTSTANDING", "OVERDUE AMOUNT"],
     "MPR": ["MONTHLY PAYMENT RATE", "MPR VALUE", "MAD"],
@@ -72,67 +82,127 @@ TEMPLATES = {
     "INSUFF SMS NOT DUE (AOD-MPR)": st.secrets["templates"]["INSUFF_SMS_NOT_DUE_AOD_MPR"],
 }
 
+# Templates pre-split once into literal / {PLACEHOLDER} segments for format_preview
+_PLACEHOLDER_RE = re.compile(r"(\{[A-Z_ ]+\})")
+_TEMPLATE_PARTS = {name: tuple(_PLACEHOLDER_RE.split(body)) for name, body in TEMPLATES.items()}
+
 
 # =========================================================
 # UTILITY FUNCTIONS
 # =========================================================
+# normalize(): lowercase ASCII letters and drop every non-alphanumeric byte in one C pass
+_NORM_LOWER = bytes.maketrans(string.ascii_uppercase.encode(), string.ascii_lowercase.encode())
+_NORM_DELETE = bytes(c for c in range(256) if c not in (string.ascii_letters + string.digits).encode())
+_CYCLE_RE = re.compile(r"c(\d{1,3})", re.IGNORECASE)
+_DATE_FORMATS = ("%m/%d/%Y", "%Y-%m-%d")
+# Trailing UTC offset after a time ("...00:00Z", "...00:00:00+08:00"); dates keep wall-clock time
+_TZ_SUFFIX_RE = re.compile(r"(:\d{2}(?:\.\d+)?)\s*(?:Z|[+-]\d{2}:?\d{2})$", re.IGNORECASE)
+
+
 def normalize(col: str) -> str:
     """Normalize header for fuzzy matching."""
     if col is None:
         return ""
-    return re.sub(r"[^a-z0-9]", "", str(col).lower())
+    return str(col).encode("ascii", "ignore").translate(_NORM_LOWER, _NORM_DELETE).decode("ascii")
+
+
+def build_alias_index(aliases: Dict[str, List[str]]) -> Dict[str, tuple]:
+    """Flatten header aliases into {normalized name: (target, priority)}."""
+    index = {}
+    for target, names in aliases.items():
+        for rank, name in enumerate([target] + names):
+            index.setdefault(normalize(name), (target, rank))
+    return index
+
+
+# Built once at import; alignment is then one dict hit per existing header
+_NORM_ALIAS_INDEX = build_alias_index(HEADER_ALIASES)
 
 
 def detect_cycle_from_filename(filename: str) -> str:
     """Extract cycle number (e.g., C14) from filename."""
     if not filename:
         return ""
-    m = re.search(r"c(\d{1,3})", filename, flags=re.IGNORECASE)
+    m = _CYCLE_RE.search(filename)
     return m.group(1) if m else ""
 
 
-def map_and_align_columns(df: pd.DataFrame, target_headers: List[str]) -> pd.DataFrame:
+def dataframe_fingerprint(df: pd.DataFrame) -> tuple:
+    """Full-content cache key for DataFrames (Streamlit samples large frames by default)."""
+    return (
+        tuple(df.columns),
+        df.shape,
+        pd.util.hash_pandas_object(df, index=False).values.tobytes(),
+    )
+
+
+def map_and_align_columns(
+    df: pd.DataFrame, target_headers: List[str]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Align columns based on fuzzy/alias header matches and include a 'DETECTION NAME' column
-    showing which raw header was used for each aligned header.
+    Align columns based on fuzzy/alias header matches and return them with a detection
+    table whose 'DETECTION NAME' column shows which raw header was used for each one.
     """
     existing = list(df.columns)
-    normalized_existing = {normalize(c): c for c in existing}
+    normalized_columns = [normalize(c) for c in existing]
+    normalized_existing = dict(zip(normalized_columns, existing))
+
+    # Resolve existing headers against the alias index, keeping the best-priority hit
+    alias_matches = {}
+    for n_col, col in normalized_existing.items():
+        target, rank = _NORM_ALIAS_INDEX.get(n_col, (None, None))
+        if target is not None and rank < alias_matches.get(target, (rank + 1,))[0]:
+            alias_matches[target] = (rank, col)
+
+    # 1️⃣ Direct match / 2️⃣ aliases, via the precomputed index
+    detected = {}
+    for target in target_headers:
+        if target in alias_matches:
+            match = alias_matches[target][1]
+        else:
+            match = normalized_existing.get(normalize(target))
+        if match:
+            detected[target] = match
 
+    # 3️⃣ Fuzzy match only unclaimed columns, and only for headers not computed later
+    claimed = set(detected.values())
+    for target in target_headers:
+        if target in detected or target in COMPUTED_HEADERS:
+            continue
+        n_target = normalize(target)
+        candidates = [i for i, c in enumerate(existing) if c not in claimed]
+        # Whole-name similarity, so PTP AMT never pairs with PTP DATE
+        best = process.extractOne(
+            n_target, [normalized_columns[i] for i in candidates], scorer=fuzz.ratio, score_cutoff=80
+        )
+        if best:
+            match = existing[candidates[best[2]]]
+        else:
+            # Decorated headers such as "MPR AMT" (prefix only, not substring), then
+            # truncated ones such as "MOBILE"; min length keeps "OB"/"PTP" from matching
+            match = next(
+                (existing[i] for i in candidates if n_target and normalized_columns[i].startswith(n_target)),
+                None,
+            )
+            if match is None:
+                match = next(
+                    (
+                        existing[i]
+                        for i in candidates
+                        if len(normalized_columns[i]) >= 4 and n_target.startswith(normalized_columns[i])
+                    ),
+                    None,
+                )
+        if match is not None:
+            detected[target] = match
+            claimed.add(match)
+
+    # 4️⃣ If still not found, fill with NA
     out = pd.DataFrame()
     detection_info = {}
-
     for target in target_headers:
-        n_target = normalize(target)
-        detected_col = None
-
-        # 1️⃣ Direct match
-        if n_target in normalized_existing:
-            detected_col = normalized_existing[n_target]
-            out[target] = df[detected_col]
-
-        # 2️⃣ Try aliases (with normalization)
-        elif target in HEADER_ALIASES:
-            for alias in HEADER_ALIASES[target]:
-                n_alias = normalize(alias)
-                match = next((normalized_existing[c] for c in normalized_existing if n_alias == c), None)
-                if match:
-                    detected_col = match
-                    out[target] = df[detected_col]
-                    break
-
-        # 3️⃣ Try fuzzy match (partial match)
-        if detected_col is None:
-            for c in existing:
-                if n_target in normalize(c) or normalize(c) in n_target:
-                    detected_col = c
-                    out[target] = df[c]
-                    break
-
-        # 4️⃣ If still not found, fill with NA
-        if detected_col is None:
-            out[target] = pd.NA
-
+        detected_col = detected.get(target)
+        out[target] = df[detected_col] if detected_col is not None else pd.NA
         detection_info[target] = detected_col if detected_col else "(Not Found)"
 
     # --- Create Detection Table ---
@@ -141,114 +211,72 @@ def map_and_align_columns(df: pd.DataFrame, target_headers: List[str]) -> pd.Dat
         "DETECTION NAME": list(detection_info.values())
     })
 
-    with st.expander("🧭 Column Detection Reference", expanded=False):
-        st.dataframe(detection_df, use_container_width=True)
+    return out, detection_df
 
-    return out
+
+def calculate_bucket(ob: pd.Series) -> pd.Series:
+    """Compute bucket category from numeric OB values (missing/invalid/negative -> NA)."""
+    buckets = pd.cut(
+        ob,
+        bins=[0, 6000, 50000, 100000, np.inf],
+        labels=["0 - 5K", "6K - 49K", "50K - 99K", "100K and up"],
+        right=False,
+    )
+    return buckets.astype(object).where(buckets.notna(), pd.NA)
 
 
-def calculate_bucket(ob_value):
-    """Compute bucket category based on OB value safely."""
+def _naive_timestamp(value) -> pd.Timestamp:
+    """Coerce one parsed value to a naive (wall-clock) Timestamp, NaT if unusable."""
     try:
-        val = float(str(ob_value).replace(",", "").strip())
-        if pd.isna(val):
-            return pd.NA
-        if val >= 100000:
-            return "100K and up"
-        elif val >= 50000:
-            return "50K - 99K"
-        elif val >= 6000:
-            return "6K - 49K"
-        elif val >= 0:
-            return "0 - 5K"
-        else:
-            return pd.NA
-    except Exception:
-        return pd.NA
+        ts = pd.Timestamp(value)
+    except (ValueError, TypeError, OverflowError):
+        return pd.NaT
+    return ts.tz_localize(None) if ts is not pd.NaT and ts.tzinfo is not None else ts
 
 
-def format_excel_text_date(value) -> str:
+def to_naive_datetime(values: pd.Series, **kwargs) -> pd.Series:
+    """pd.to_datetime(errors="coerce") that always returns naive datetime64 values."""
+    try:
+        parsed = pd.to_datetime(values, errors="coerce", **kwargs)
+    except (ValueError, TypeError, OverflowError):
+        # One odd cell must not fail the whole column: parse cell by cell instead
+        parsed = values.map(lambda v: _naive_timestamp(pd.to_datetime(v, errors="coerce", **kwargs)))
+    if isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        return parsed.dt.tz_localize(None)
+    if parsed.dtype == object:  # mixed tz-aware / naive results
+        return pd.to_datetime(parsed.map(_naive_timestamp))
+    return parsed
+
+
+def format_excel_text_date(values: pd.Series) -> pd.Series:
     """Normalize various date representations into MM/DD/YYYY (no time).
 
     Handles:
-    - datetime objects
     - common date/time strings (with or without time)
     - Excel serial numbers (as int/float or digit-strings)
     - returns empty string for missing values
     """
-    if pd.isna(value):
-        return ""
+    s = values.fillna("").astype(str).str.strip()
+    token = s.str.split().str[0].fillna("")
+    s_local = s.str.replace(_TZ_SUFFIX_RE, r"\1", regex=True)
+    token_local = token.str.replace(_TZ_SUFFIX_RE, r"\1", regex=True)
 
-    s = str(value).strip()
-    if s == "":
-        return ""
+    # Excel serials: digit-strings that are reasonably large
+    serial = pd.to_numeric(s.where(s.str.fullmatch(r"\d+(?:\.0+)?")), errors="coerce")
+    dt = to_naive_datetime(serial.where(serial > 31), unit="D", origin="1899-12-30")
 
-    # Try direct pandas parsing first
-    try:
-        # If value looks numeric (possible Excel serial), try origin conversion
-        if re.fullmatch(r"\d+(?:\.0+)?", s):
-            try:
-                num = float(s)
-                # treat as excel serial when value is reasonably large
-                if num > 31:
-                    dt = pd.to_datetime(num, unit="D", origin="1899-12-30", errors="coerce")
-                    if not pd.isna(dt):
-                        return dt.strftime("%m/%d/%Y")
-            except Exception:
-                pass
-
-        # Generic parse (works for many string formats and datetime objects)
-        dt = pd.to_datetime(s, errors="coerce", infer_datetime_format=True)
-        if not pd.isna(dt):
-            return dt.strftime("%m/%d/%Y")
-
-        # Fallback: try parsing only the first token (strip time)
-        token = s.split()[0]
-        dt = pd.to_datetime(token, errors="coerce", infer_datetime_format=True)
-        if not pd.isna(dt):
-            return dt.strftime("%m/%d/%Y")
-    except Exception:
-        pass
-
-    # Last resort: return the date-like portion without time
-    return s.split()[0]
-
-
-def process_data(df: pd.DataFrame, cycle: str) -> pd.DataFrame:
-    """Complete all transformations and computed fields."""
-    result = map_and_align_columns(df, TARGET_HEADERS)
-
-    # --- Format Excel text-style dates ---
-    for date_col in ["PTP DATE", "TPAP DD"]:
-        if date_col in result.columns:
-            result[date_col] = result[date_col].apply(format_excel_text_date)
+    # Fast path: explicit formats on the date token (time stripped)
+    for fmt in _DATE_FORMATS:
+        dt = dt.fillna(to_naive_datetime(token_local, format=fmt))
 
-    # --- Continue normal flow ---
-    result["CYCLE"] = cycle
-    result["BUCKET"] = result["OB"].apply(calculate_bucket)
-    result["WITH CONTACT Y/N"] = result["MOBILE NUMBER"].apply(check_contact)
+    # Stragglers only: generic parse, then fallback to the first token
+    for fallback in (s_local, token_local):
+        pending = dt.isna() & (s != "")
+        if pending.any():
+            dt = dt.fillna(to_naive_datetime(fallback[pending], format="mixed"))
 
-    # ✅ Keep SMS TEMPLATE from raw file if already exists
-    if "SMS TEMPLATE" not in df.columns:
-        result["SMS TEMPLATE"] = result.apply(detect_template, axis=1)
-
-    # --- Always generate preview based on the detected or existing template
-    result["PREVIEW"] = result.apply(
-        lambda r: format_preview(TEMPLATES.get(r["SMS TEMPLATE"], ""), r),
-        axis=1
-    )
-
-    return result
-    # --- Reorder columns: insert BUCKET right after TPAP DD ---
-    if "TPAP DD" in result.columns and "BUCKET" in result.columns:
-        cols = list(result.columns)
-        tpap_index = cols.index("TPAP DD")
-        # Remove and reinsert BUCKET right after TPAP DD
-        cols.remove("BUCKET")
-        cols.insert(tpap_index + 1, "BUCKET")
-        result = result[cols]
-
-    return result
+    # Last resort: keep the date-like portion without time
+    return dt.dt.strftime("%m/%d/%Y").fillna(token).where(s != "", "")
 
 
 def with_contact_flag(mobile):
@@ -261,97 +289,184 @@ def with_contact_flag(mobile):
 
 
 
-def check_contact(mobile: str) -> str:
-    """Validate contact number format."""
-    if pd.isna(mobile):
-        return "N"
-    m = str(mobile).strip()
-    return "Y" if re.match(r"^63\d{10}$", m) else "N"
-
+def check_contact(mobile: pd.Series) -> pd.Series:
+    """Validate contact number format (vectorized)."""
+    valid = mobile.fillna("").astype(str).str.strip().str.match(r"^63\d{10}$")
+    return valid.map({True: "Y", False: "N"})
 
-def detect_template(row):
-    # Safely extract numeric fields
-    ob_val = row.get("OB", 0)
-    mpr_val = row.get("MPR", 0)
-    pda_val = row.get("PDA", 0)
 
-    try:
-        ob = float(ob_val) if pd.notna(ob_val) and str(ob_val).strip() != "" else 0.0
-        mpr = float(mpr_val) if pd.notna(mpr_val) and str(mpr_val).strip() != "" else 0.0
-        pda = float(pda_val) if pd.notna(pda_val) and str(pda_val).strip() != "" else 0.0
-    except ValueError:
-        ob, mpr, pda = 0.0, 0.0, 0.0
+def detect_template(amounts: pd.DataFrame) -> pd.Series:
+    """Pick a payment-based template from numeric MPR/PDA amounts (vectorized)."""
+    mpr = amounts["MPR"].to_numpy(dtype=float)
+    pda = amounts["PDA"].to_numpy(dtype=float)
 
     # Example logic (adjust yours here)
-    if mpr > 0 and pda == 0:
-        return "WITH MPR ONLY"
-    elif pda > 0 and mpr == 0:
-        return "WITH PDA ONLY"
-    elif mpr > 0 and pda > 0:
-        return "WITH BOTH MPR AND PDA"
-    else:
-        return "NO PAYMENT"
-
-
-def format_preview(template, row):
-    """Fill in SMS template placeholders using row values, including formatted TPAP DD."""
-
-    def safe_float(val):
-        try:
-            if pd.isna(val) or str(val).strip() in ["", "nan", "None"]:
-                return 0.0
-            return float(val)
-        except Exception:
-            return 0.0
-
-    # --- Safe replacements ---
+    choices = np.select(
+        [(mpr > 0) & (pda == 0), (pda > 0) & (mpr == 0), (mpr > 0) & (pda > 0)],
+        ["WITH MPR ONLY", "WITH PDA ONLY", "WITH BOTH MPR AND PDA"],
+        default="NO PAYMENT",
+    )
+    return pd.Series(choices, index=amounts.index, dtype=object)
+
+
+def format_preview(df: pd.DataFrame, amounts: pd.DataFrame) -> pd.Series:
+    """Fill in SMS template placeholders for all rows, one template group at a time."""
+
+    # --- Precomputed replacement columns ---
     replacements = {
-        "{CUST_NAME}": str(row.get("CUSTOMER NAME", "")),
-        "{ACC_NO}": str(row.get("LOAN NUMBER", "")),  # fixed to use LOAN NUMBER, not ACCOUNT NUMBER
-        "{OB}": f"{safe_float(row.get('OB', 0)):,.2f}",
-        "{MPR}": f"{safe_float(row.get('MPR', 0)):,.2f}",
-        "{PDA}": f"{safe_float(row.get('PDA', 0)):,.2f}",
-        "{TPAP DD}": str(row.get("TPAP DD", "")),     # ✅ Add this line
-        "{PTP DATE}": str(row.get("PTP DATE", "")),   # optional: in case template uses it
-        "{CYCLE}": str(row.get("CYCLE", "")),         # corrected from COLLECTION_CYCLE
+        "{CUST_NAME}": df["CUSTOMER NAME"].astype(str),
+        "{ACC_NO}": df["LOAN NUMBER"].astype(str),  # fixed to use LOAN NUMBER, not ACCOUNT NUMBER
+        "{OB}": amounts["OB"].map("{:,.2f}".format),
+        "{MPR}": amounts["MPR"].map("{:,.2f}".format),
+        "{PDA}": amounts["PDA"].map("{:,.2f}".format),
+        "{TPAP DD}": df["TPAP DD"].astype(str),
+        "{PTP DATE}": df["PTP DATE"].astype(str),   # optional: in case template uses it
+        "{CYCLE}": df["CYCLE"].astype(str),         # corrected from COLLECTION_CYCLE
     }
 
-    # --- Apply all replacements ---
-    for key, value in replacements.items():
-        template = template.replace(key, value)
+    # --- Build each template group by concatenating literals and columns ---
+    preview = pd.Series("", index=df.index, dtype=object)
+    for name, index in df.groupby("SMS TEMPLATE", sort=False).groups.items():
+        parts = _TEMPLATE_PARTS.get(name)
+        if parts is None:
+            continue
+        text = pd.Series("", index=index, dtype=object)
+        for part in parts:
+            text = text + (replacements[part].loc[index] if part in replacements else part)
+        preview.loc[index] = text
 
-    return template
+    return preview
 
 
 def xlookup_pda(main_df: pd.DataFrame, pda_df: pd.DataFrame) -> pd.DataFrame:
     """Perform PDA merge (XLOOKUP style)."""
-    lookup = pda_df.set_index("LOAN NUMBER")["PDA"].to_dict()
-    main_df["PDA"] = main_df["LOAN NUMBER"].map(lambda x: lookup.get(str(x).strip(), pd.NA))
+    lookup = pda_df["PDA"].set_axis(pda_df["LOAN NUMBER"].astype(str).str.strip())
+    lookup = lookup[~lookup.index.duplicated(keep="last")]  # last match wins, like a dict
+    main_df["PDA"] = main_df["LOAN NUMBER"].astype(str).str.strip().map(lookup)
     return main_df
 
 
-def process_data(df: pd.DataFrame, cycle: str) -> pd.DataFrame:
-    """Complete all transformations and computed fields."""
-    result = map_and_align_columns(df, TARGET_HEADERS)
+@st.cache_data(
+    show_spinner=False,
+    max_entries=8,
+    ttl="1h",
+    hash_funcs={pd.DataFrame: dataframe_fingerprint},
+)
+def process_data(df: pd.DataFrame, cycle: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Complete all transformations and computed fields (returns data + detection table)."""
+    result, detection_df = map_and_align_columns(df, TARGET_HEADERS)
+
+    # --- Clean amount fields as text for export; convert to float once for computed fields
+    numeric = pd.DataFrame(index=result.index)  # NaN where not found / not a number
+    for col in ["OB", "MPR", "PDA"]:
+        cleaned = (
+            result[col]
+            .astype(str)
+            .str.replace(",", "", regex=False)
+            .str.strip()
+            .replace({"": "0", "nan": "0", "None": "0"})
+        )
+        result[col] = cleaned.mask(result[col].isna())  # columns not found stay NA
+        numeric[col] = pd.to_numeric(result[col], errors="coerce").astype(float)
+    amounts = numeric.fillna(0.0)  # for template detection and PREVIEW only
+
     # --- Normalize date fields to MM/DD/YYYY (no time)
     for date_col in ["PTP DATE", "TPAP DD"]:
         if date_col in result.columns:
-            result[date_col] = result[date_col].apply(format_excel_text_date)
+            result[date_col] = format_excel_text_date(result[date_col])
 
     result["CYCLE"] = cycle
-    result["BUCKET"] = result["OB"].apply(calculate_bucket)
-    result["WITH CONTACT Y/N"] = result["MOBILE NUMBER"].apply(check_contact)
-    result["PREVIEW"] = result.apply(
-        lambda r: format_preview(TEMPLATES.get(r["SMS TEMPLATE"], ""), r), axis=1
-    )
+    result["BUCKET"] = calculate_bucket(numeric["OB"])
+    result["WITH CONTACT Y/N"] = check_contact(result["MOBILE NUMBER"])
+
+    # ✅ Keep SMS TEMPLATE from raw file if it was detected
+    if result["SMS TEMPLATE"].isna().all():
+        result["SMS TEMPLATE"] = detect_template(amounts)
+
+    # --- Always generate preview based on the detected or existing template
+    result["PREVIEW"] = format_preview(result, amounts)
+
+    return result, detection_df
+
+
+def read_csv_as_text(buffer: io.BytesIO) -> pd.DataFrame:
+    """Read CSV with PyArrow, keeping every column as Arrow-backed text.
+
+    pandas' pyarrow engine infers types before applying dtype=str (dropping
+    leading zeros in loan/mobile numbers), so column types are set explicitly.
+    Files PyArrow rejects (e.g. rows shorter than the header) fall back to the
+    pandas parser, which pads missing fields with "".
+    """
+    try:
+        names = list(pa_csv.open_csv(buffer).schema.names)
+    except pa.ArrowInvalid:
+        buffer.seek(0)
+        return pd.read_csv(buffer, dtype=str, na_filter=False)
+    buffer.seek(0)
+
+    # Name headers the way pandas does: blanks -> "Unnamed: N", repeats -> NAME.1, NAME.2, ...
+    # skipping suffixes already used by another header
+    names = [name or f"Unnamed: {i}" for i, name in enumerate(names)]
+    taken = set(names)
+    seen = set()
+    for i, name in enumerate(names):
+        if name in seen:
+            suffix = 1
+            while f"{name}.{suffix}" in taken:
+                suffix += 1
+            names[i] = f"{name}.{suffix}"
+            taken.add(names[i])
+        seen.add(names[i])
+
+    try:
+        table = pa_csv.read_csv(
+            buffer,
+            read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1),
+            convert_options=pa_csv.ConvertOptions(column_types={n: pa.string() for n in names}),
+        )
+    except pa.ArrowInvalid:
+        buffer.seek(0)
+        return pd.read_csv(buffer, dtype=str, na_filter=False)
+    return table.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl="1h")
+def load_uploaded_file(name: str, data: bytes) -> pd.DataFrame:
+    """Read uploaded CSV/Excel bytes as all-text columns (cached per file content)."""
+    buffer = io.BytesIO(data)
+    if name.lower().endswith(".csv"):
+        return read_csv_as_text(buffer)
+    return pd.read_excel(buffer, dtype=str, na_filter=False, engine="calamine")
+
+
+@st.cache_data(
+    show_spinner=False,
+    max_entries=8,
+    ttl="1h",
+    hash_funcs={pd.DataFrame: dataframe_fingerprint},
+)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Encode DataFrame as a UTF-8 CSV download (cached per content)."""
+    return df.to_csv(index=False).encode("utf-8")
 
-    return result
 
 def to_excel_bytes(df: pd.DataFrame) -> bytes:
-    """Convert DataFrame to downloadable Excel file in memory."""
+    """Convert DataFrame to downloadable Excel file, streaming rows in constant memory.
+
+    xlsxwriter's constant_memory mode only keeps one row in RAM, so rows must be
+    written in order; pandas' to_excel writes column by column, hence write_row.
+    """
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="SMS Data")
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True, "strings_to_numbers": False})
+    sheet = workbook.add_worksheet("SMS Data")
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+
+    sheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+    values = df.astype(object).where(df.notna(), None)  # NA/NaN -> blank cells
+    for row_idx, row in enumerate(values.itertuples(index=False, name=None), start=1):
+        sheet.write_row(row_idx, 0, row)
+
+    workbook.close()
     return output.getvalue()
 
 
@@ -383,30 +498,30 @@ def main():
             st.info(f"Detected CYCLE: **C{cycle or 'N/A'}**")
 
             try:
-                # --- Read uploaded file ---
-                if fname.lower().endswith(".csv"):
-                    df = pd.read_csv(uploaded_main, dtype=str, na_filter=False)
+                data = uploaded_main.getvalue()
+                upload_hash = hashlib.blake2b(fname.encode(), digest_size=16)
+                upload_hash.update(data)
+                upload_hash = upload_hash.hexdigest()
+
+                # --- Reuse the last result if this exact upload was already processed ---
+                if st.session_state.get("processed_hash") == upload_hash:
+                    processed = st.session_state["processed_main"]
+                    detection_df = st.session_state["detection_main"]
                 else:
-                    df = pd.read_excel(uploaded_main, dtype=str, na_filter=False)
-
-                # --- Clean numeric fields (OB, MPR, PDA) before processing ---
-                for col in ["OB", "MPR", "PDA"]:
-                    if col in df.columns:
-                        df[col] = (
-                            df[col]
-                            .astype(str)
-                            .str.replace(",", "", regex=False)
-                            .str.strip()
-                            .replace({"": "0", "nan": "0", "None": "0"})
-                        )
-
-                # --- Process file ---
-                processed = process_data(df, cycle)
+                    # --- Read uploaded file (cached on name + content) ---
+                    df = load_uploaded_file(fname, data)
+
+                    # --- Process file ---
+                    processed, detection_df = process_data(df, cycle)
+                    st.session_state["processed_main"] = processed
+                    st.session_state["detection_main"] = detection_df
+                    st.session_state["main_filename"] = fname
+                    st.session_state["processed_hash"] = upload_hash
 
                 # --- Display results ---
+                with st.expander("🧭 Column Detection Reference", expanded=False):
+                    st.dataframe(detection_df, use_container_width=True)
                 st.dataframe(processed.head(10), use_container_width=True)
-                st.session_state["processed_main"] = processed
-                st.session_state["main_filename"] = fname
                 st.success("✅ Primary file processed successfully!")
 
             except Exception as e:
@@ -436,8 +551,7 @@ def main():
          # --- Downloads
             st.markdown("### 💾 Download Files")
 
-            csv_full = df.to_csv(index=False).encode("utf-8")
-            csv_export = df[EXPORT_HEADERS].to_csv(index=False).encode("utf-8")
+            csv_full = to_csv_bytes(df)
 
             st.download_button(
                 "📥 Full CSV (with Preview)",